@@ -4,7 +4,7 @@ block_cipher = None
 
 a = Analysis(
     ['floss/main.py'],
-             pathex=['floss'],
+             pathex=['.'],
              binaries=None,
              datas=None,
              hiddenimports=[
@@ -1,4 +1,4 @@
-from utils import ONE_MB
-from utils import STACK_MEM_NAME
-from utils import makeEmulator
-from utils import removeStackMemory
+from floss.utils import ONE_MB
+from floss.utils import STACK_MEM_NAME
+from floss.utils import makeEmulator
+from floss.utils import removeStackMemory
@@ -1,4 +1,7 @@
+import bisect
+import struct
 import logging
+import itertools
 from collections import namedtuple
 
 from enum import Enum
@@ -22,30 +25,110 @@ class LocationType(Enum):
     HEAP = 3
 
 
+# StackOps are routines that access the stack of an emulator with a given pointer size
+StackOps = namedtuple("StackOps",
+        [   "pointer_size",  # type: int
+            "get_stack_value",  # type: Callable[[envi.Emulator, int], int]
+            "pop_stack",  # type: Callable[[envi.Emulator], int]
+            "get_stack_values",  # type: Callable[[envi.Emulator, int, int], Tuple[int, ...]]
+            ])
+
+
+def make_stack_ops(pointer_size):
+    '''
+    Create the routines that access the stack of an emulator with the given pointer size.
+    The pointer format is fixed up front, rather than resolved on each
+     access, as `emu.readMemoryFormat(va, "<P")` does.
+
+    :type pointer_size: int
+    :rtype: StackOps
+    '''
+    pointer_format = {4: "I", 8: "Q"}[pointer_size]
+    pointer = struct.Struct("<" + pointer_format)
+
+    def get_stack_value(emu, offset):
+        return pointer.unpack(emu.readMemory(emu.getStackCounter() + offset, pointer_size))[0]
+
+    def pop_stack(emu):
+        sp = emu.getStackCounter()
+        v = pointer.unpack(emu.readMemory(sp, pointer_size))[0]
+        emu.setStackCounter(sp + pointer_size)
+        return v
+
+    # maps from count to the format of that many consecutive pointers
+    windows = {}
+
+    def get_stack_values(emu, offset, count):
+        window = windows.get(count)
+        if window is None:
+            window = struct.Struct("<%d%s" % (count, pointer_format))
+            windows[count] = window
+
+        va = emu.getStackCounter() + offset
+        if emu.probeMemory(va, window.size, envi.memory.MM_READ):
+            # read `count` consecutive values with a single memory access
+            return window.unpack(emu.readMemory(va, window.size))
+
+        # the values run past the end of the memory map, so read them one at a time,
+        #  up to the first value that can't be read.
+        values = []
+        for i in range(count):
+            try:
+                values.append(pointer.unpack(emu.readMemory(va + i * pointer_size, pointer_size))[0])
+            except envi.SegmentationViolation:
+                break
+        return tuple(values)
+
+    return StackOps(pointer_size, get_stack_value, pop_stack, get_stack_values)
+
+
+# maps from pointer size to StackOps, created once at import
+STACK_OPS = {
+    4: make_stack_ops(4),
+    8: make_stack_ops(8),
+}
+
+
 class ApiMonitor(viv_utils.emulator_drivers.Monitor):
     '''
     The ApiMonitor observes emulation and provides an interface
      for hooking API calls.
     '''
-    def __init__(self, vw, function_index):
+    def __init__(self, vw, function_index, stack_ops=None):
         viv_utils.emulator_drivers.Monitor.__init__(self, vw)
         self.function_index = function_index
+        if stack_ops is None:
+            stack_ops = STACK_OPS[vw.psize]
+        self._stack = stack_ops
+        # cache of `ret` instruction VA to the set of valid return VAs
+        self._ret_insn_cache = {}
+        # cache of function start VA to the set of valid return VAs
+        self._ret_va_cache = {}
+        # optimization: these hooks run for every emulated instruction,
+        #  so avoid building log messages that would be dropped anyway.
+        self._debug = self._logger.isEnabledFor(logging.DEBUG)
 
     def apicall(self, emu, op, pc, api, argv):
         # overridden from Monitor
-        self.d("apicall: %s %s %s %s %s", emu, op, pc, api, argv)
+        if self._debug:
+            self.d("apicall: %s %s %s %s %s", emu, op, pc, api, argv)
 
     def prehook(self, emu, op, startpc):
         # overridden from Monitor
-        self.d("%s: %s", hex(startpc), op)
+        if self._debug:
+            self.d("0x%08X: %s", startpc, op)
 
     def posthook(self, emu, op, endpc):
         # overridden from Monitor
-        if op.mnem == "ret":
+        # optimization: test the instruction flags before comparing the mnemonic,
+        #  since this runs for every emulated instruction.
+        # far returns (`retf`, `iret`) also set IF_RET, but pop more than a return address.
+        if op.iflags & envi.IF_RET and op.mnem == "ret":
             try:
                 self._check_return(emu, op)
             except Exception as e:
-                self.d(str(e))
+                if self._debug:
+                    self.d("%s", e)
 
     def _check_return(self, emu, op):
         '''
@@ -54,33 +137,45 @@ class ApiMonitor(viv_utils.emulator_drivers.Monitor):
         _fix_return modifies program counter and stack pointer if a valid return address is found
         on the stack or raises an Exception if no valid return address is found.
         '''
-        function_start = self.function_index[op.va]
-        return_addresses = self._get_return_vas(emu, function_start)
+        # optimization: this runs for every emulated return, so resolve
+        #  the return addresses with a single lookup in the common case.
+        return_addresses = self._ret_insn_cache.get(op.va)
+        if return_addresses is None:
+            function_start = self.function_index[op.va]
+            return_addresses = self._ret_va_cache.get(function_start)
+            if return_addresses is None:
+                return_addresses = self._get_return_vas(emu, function_start)
+                self._ret_va_cache[function_start] = return_addresses
+            self._ret_insn_cache[op.va] = return_addresses
 
         if op.opers:
             # adjust stack in case of `ret imm16` instruction
             emu.setStackCounter(emu.getStackCounter() - op.opers[0].imm)
 
-        return_address = self.getStackValue(emu, -4)
+        return_address = self._stack.get_stack_value(emu, -self._stack.pointer_size)
         if return_address not in return_addresses:
-            self._logger.debug("Return address 0x%08X is invalid", return_address)
+            if self._debug:
+                self._logger.debug("Return address 0x%08X is invalid", return_address)
             self._fix_return(emu, return_address, return_addresses)
             # TODO return, handle Exception
         else:
-            self._logger.debug("Return address 0x%08X is valid, returning", return_address)
+            if self._debug:
+                self._logger.debug("Return address 0x%08X is valid, returning", return_address)
             # TODO return?
 
     def _get_return_vas(self, emu, function_start):
         '''
-        Get the list of valid addresses to which a function should return.
+        Get the set of valid addresses to which a function should return.
+
+        :rtype: frozenset[int]
         '''
-        return_vas = []
+        return_vas = set()
         callers = self._vw.getCallers(function_start)
         for caller in callers:
             call_op = emu.parseOpcode(caller)
             return_va = call_op.va + call_op.size
-            return_vas.append(return_va)
-        return return_vas
+            return_vas.add(return_va)
+        return frozenset(return_vas)
 
     def _fix_return(self, emu, return_address, return_addresses):
         '''
@@ -90,15 +185,16 @@ class ApiMonitor(viv_utils.emulator_drivers.Monitor):
         '''
         self.dumpStack(emu)
         NUM_ADDRESSES = 4
-        pointer_size = emu.getPointerSize()
-        STACK_SEARCH_WINDOW = pointer_size * NUM_ADDRESSES
+        pointer_size = self._stack.pointer_size
         esp = emu.getStackCounter()
-        for offset in xrange(0, STACK_SEARCH_WINDOW, pointer_size):
-            ret_va_candidate = self.getStackValue(emu, offset)
+        ret_va_candidates = self._stack.get_stack_values(emu, 0, NUM_ADDRESSES)
+        for i, ret_va_candidate in enumerate(ret_va_candidates):
+            offset = i * pointer_size
             if ret_va_candidate in return_addresses:
                 emu.setProgramCounter(ret_va_candidate)
                 emu.setStackCounter(esp + offset + pointer_size)
-                self._logger.debug("Returning to 0x%08X, adjusted stack:", ret_va_candidate)
+                if self._debug:
+                    self._logger.debug("Returning to 0x%08X, adjusted stack:", ret_va_candidate)
                 self.dumpStack(emu)
                 return
 
@@ -110,14 +206,19 @@ class ApiMonitor(viv_utils.emulator_drivers.Monitor):
         Convenience debugging routine for showing
          state current state of the stack.
         '''
+        if not self._debug:
+            # building the dump reads eight stack values, so skip it entirely
+            return
+
         esp = emu.getStackCounter()
+        pointer_size = self._stack.pointer_size
         stack_str = ""
-        for i in xrange(16, -16, -4):
+        for i in range(4 * pointer_size, -4 * pointer_size, -pointer_size):
             if i == 0:
                 sp = "<= SP"
             else:
                 sp = "%02d" % i
-            stack_str = "%s\n0x%08X - 0x%08X %s" % (stack_str, (esp + i), self.getStackValue(emu, i), sp)
+            stack_str = "%s\n0x%08X - 0x%08X %s" % (stack_str, (esp + i), self._stack.get_stack_value(emu, i), sp)
         self._logger.debug(stack_str)
 
 
@@ -134,26 +235,16 @@ def pointerSize(emu):
 def popStack(emu):
     '''
     Remove the element at the top of the stack.
+    Prefer the `pop_stack` of `STACK_OPS`, which is already specialized for the pointer size.
     :rtype: int
     '''
-    v = emu.readMemoryFormat(emu.getStackCounter(), "<P")[0]
-    emu.setStackCounter(emu.getStackCounter() + pointerSize(emu))
-    return v
+    return STACK_OPS[emu.imem_psize].pop_stack(emu)
 
 
-class GetProcessHeapHook(viv_utils.emulator_drivers.Hook):
-    '''
-    Hook and handle calls to GetProcessHeap, returning 0.
-    '''
-    def hook(self, callname, emu, callconv, api, argv):
-        if callname == "kernel32.GetProcessHeap":
-            # nop
-            callconv.execCallReturn(emu, 0, len(argv))
-            return True
-        raise viv_utils.emulator_drivers.UnsupportedFunction()
+PAGE_SIZE = 0x1000
 
 
-def round(i, size):
+def round_up(i, size):
     '''
     Round `i` to the nearest greater-or-equal-to multiple of `size`.
 
@@ -163,91 +254,154 @@ def round(i, size):
     '''
     if i % size == 0:
         return i
-    return i + (i - (i % size))
+    return i + (size - (i % size))
 
 
-class RtlAllocateHeapHook(viv_utils.emulator_drivers.Hook):
+class HeapArena(object):
     '''
-    Hook calls to RtlAllocateHeap, allocate memory in a "heap"
-     section, and return pointers to this memory.
+    Bump allocator that backs the emulated heap.
+    Consecutive allocations are served from the same memory map while they fit,
+     otherwise a new map sized to the allocation is added, rounded up to a page.
+    Maps are kept small because emulated writes copy the whole map they touch.
     The base heap address is 0x69690000.
-    The max allocation size is 10 MB.
     '''
-    def __init__(self, *args, **kwargs):
-        super(RtlAllocateHeapHook, self).__init__(*args, **kwargs)
-        self._heap_addr = 0x69690000
-
-    MAX_ALLOCATION_SIZE = 10 * 1024 * 1024
+    BASE_ADDRESS = 0x69690000
+    ALIGNMENT = 0x10
+
+    def __init__(self):
+        # start of the current memory map
+        self._start = self.BASE_ADDRESS
+        # next free address in the current memory map
+        self._next = self.BASE_ADDRESS
+        # end of the memory mapped so far
+        self._end = self.BASE_ADDRESS
+        # (start, end) of each allocation in the current memory map
+        self._allocations = []
+        # (start, end, allocations) of the earlier memory maps
+        self._full = []
+
+    def allocate(self, emu, size):
+        '''
+        Reserve `size` bytes of zero-filled memory in the emulator.
 
-    def _allocate_mem(self, emu, size):
-        size = round(size, 0x1000)
-        if size > self.MAX_ALLOCATION_SIZE:
-            size = self.MAX_ALLOCATION_SIZE
-        va = self._heap_addr
-        self.d("RtlAllocateHeap: mapping %s bytes at %s", hex(size), hex(va))
-        emu.addMemoryMap(va, envi.memory.MM_RWX, "[heap allocation]", "\x00" * (size + 4))
-        emu.writeMemory(va, "\x00" * size)
-        self._heap_addr += size
+        :type size: int
+        :rtype: int
+        :return: the address of the new allocation.
+        '''
+        size = round_up(max(size, 1), self.ALIGNMENT)
+        if self._next + size > self._end:
+            # allocations may not span memory maps, so start a fresh one
+            if self._start < self._end:
+                self._full.append((self._start, self._end, tuple(self._allocations)))
+            map_size = round_up(size, PAGE_SIZE)
+            emu.addMemoryMap(self._end, envi.memory.MM_RWX, "[heap]", bytes(map_size))
+            self._start = self._next = self._end
+            self._end += map_size
+            self._allocations = []
+        va = self._next
+        self._next += size
+        self._allocations.append((va, self._next))
         return va
 
-    def hook(self, callname, driver, callconv, api, argv):
-        # works for kernel32.HeapAlloc
-        if callname == "ntdll.RtlAllocateHeap":
-            emu = driver
-            size = driver.getStackValue(0xC)
-            va = self._allocate_mem(emu, size)
-            callconv.execCallReturn(emu, va, len(argv))
-            return True
-        raise viv_utils.emulator_drivers.UnsupportedFunction()
+    def get_allocated(self):
+        '''
+        Get the memory handed out so far, for each memory map of the heap.
+        The rest of each map is unused.
 
+        :rtype: List[Tuple[int, int, Tuple[Tuple[int, int], ...]]]
+        :return: tuples of (map start, map end, (start, end) of each allocation in the map).
+        '''
+        allocated = list(self._full)
+        if self._start < self._end:
+            allocated.append((self._start, self._end, tuple(self._allocations)))
+        return allocated
 
-class AllocateHeap(RtlAllocateHeapHook):
+
+class DispatchHook(viv_utils.emulator_drivers.Hook):
     '''
-    Hook calls to AllocateHeap and handle them like calls to RtlAllocateHeapHook.
+    Hook and shim calls to library functions, such as memory allocation routines.
+    Each call is dispatched to its handler with a single lookup by API name.
+    Allocations are served from the given HeapArena.
+    The max allocation size is 10 MB.
     '''
-    def __init__(self, *args, **kwargs):
-        super(AllocateHeap, self).__init__(*args, **kwargs)
+    MAX_ALLOCATION_SIZE = 10 * 1024 * 1024
 
-    def hook(self, callname, driver, callconv, api, argv):
-        if callname == "kernel32.LocalAlloc" or \
-           callname == "kernel32.GlobalAlloc" or \
-           callname == "kernel32.VirtualAlloc":
-            emu = driver
-            # TODO dependant on calling convention, see issue #124
-            size = driver.getStackValue(0x8)
-            va = self._allocate_mem(emu, size)
-            callconv.execCallReturn(emu, va, len(argv))
-            return True
-        raise viv_utils.emulator_drivers.UnsupportedFunction()
+    def __init__(self, heap=None, stack_ops=None):
+        super(DispatchHook, self).__init__()
+        # like the ApiMonitor, follow the pointer size of the emulated code.
+        # when not given, the stack ops are picked on the first hooked call.
+        self._stack = stack_ops
+        self._debug = self._logger.isEnabledFor(logging.DEBUG)
+        self.reset(heap)
 
+    def reset(self, heap=None):
+        '''
+        Serve future allocations from the given HeapArena, or a new one.
+        '''
+        if heap is None:
+            heap = HeapArena()
+        self._heap = heap
 
-class MallocHeap(RtlAllocateHeapHook):
-    '''
-    Hook calls to malloc and handle them like calls to RtlAllocateHeapHook.
-    '''
-    def __init__(self, *args, **kwargs):
-        super(MallocHeap, self).__init__(*args, **kwargs)
+    def _get_stack_value(self, emu, offset):
+        if self._stack is None:
+            self._stack = STACK_OPS[emu.imem_psize]
+        return self._stack.get_stack_value(emu, offset)
 
-    def hook(self, callname, driver, callconv, api, argv):
-        if callname == "msvcrt.malloc":
-            emu = driver
-            size = driver.getStackValue(0x4)
-            va = self._allocate_mem(emu, 0x100)  # TODO hard-coded!
-            callconv.execCallReturn(emu, va, len(argv))
-            return True
-        raise viv_utils.emulator_drivers.UnsupportedFunction()
+    def _allocate_mem(self, emu, size):
+        if size > self.MAX_ALLOCATION_SIZE:
+            size = self.MAX_ALLOCATION_SIZE
+        va = self._heap.allocate(emu, size)
+        if self._debug:
+            self.d("allocated 0x%x bytes at 0x%x", size, va)
+        return va
 
+    def _handle_get_process_heap(self, driver, callconv, argv):
+        # nop
+        callconv.execCallReturn(driver, 0, len(argv))
+        return True
 
-class ExitProcessHook(viv_utils.emulator_drivers.Hook):
-    '''
-    Hook calls to ExitProcess and stop emulation when these are hit.
-    '''
-    def __init__(self, *args, **kwargs):
-        super(ExitProcessHook, self).__init__(*args, **kwargs)
+    def _handle_rtl_allocate_heap(self, driver, callconv, argv):
+        # works for kernel32.HeapAlloc
+        emu = driver
+        size = self._get_stack_value(driver._emu, 0xC)
+        va = self._allocate_mem(emu, size)
+        callconv.execCallReturn(emu, va, len(argv))
+        return True
+
+    def _handle_allocate_heap(self, driver, callconv, argv):
+        emu = driver
+        # TODO dependant on calling convention, see issue #124
+        size = self._get_stack_value(driver._emu, 0x8)
+        va = self._allocate_mem(emu, size)
+        callconv.execCallReturn(emu, va, len(argv))
+        return True
+
+    def _handle_malloc(self, driver, callconv, argv):
+        emu = driver
+        size = self._get_stack_value(driver._emu, 0x4)
+        va = self._allocate_mem(emu, 0x100)  # TODO hard-coded!
+        callconv.execCallReturn(emu, va, len(argv))
+        return True
+
+    def _handle_exit_process(self, driver, callconv, argv):
+        raise viv_utils.emulator_drivers.StopEmulation()
+
+    # maps from API name to handler
+    HANDLERS = {
+        "kernel32.GetProcessHeap": _handle_get_process_heap,
+        "ntdll.RtlAllocateHeap": _handle_rtl_allocate_heap,
+        "kernel32.LocalAlloc": _handle_allocate_heap,
+        "kernel32.GlobalAlloc": _handle_allocate_heap,
+        "kernel32.VirtualAlloc": _handle_allocate_heap,
+        "msvcrt.malloc": _handle_malloc,
+        "kernel32.ExitProcess": _handle_exit_process,
+    }
 
     def hook(self, callname, driver, callconv, api, argv):
-        if callname == "kernel32.ExitProcess":
-            raise viv_utils.emulator_drivers.StopEmulation()
+        handler = self.HANDLERS.get(callname)
+        if handler is None:
+            raise viv_utils.emulator_drivers.UnsupportedFunction()
+        return handler(self, driver, callconv, argv)
 
 
 def is_import(emu, va):
@@ -261,49 +415,348 @@ def is_import(emu, va):
     return t[1] == "import"
 
 
-# A snapshot represents the current state of the CPU and memory
-Snapshot = namedtuple("Snapshot",
-        [   "memory",  # The memory snapshot, type: envi.MemorySnapshot
-            "sp",  # The current stack counter, type: int
-            "pc",  # The current instruction pointer, type: int
-            ])
+class DirtySnapshot(object):
+    '''
+    A memory snapshot that only stores the memory written since
+     a full baseline snapshot was taken.
+    All other memory is unchanged from the baseline.
+    '''
+    def __init__(self, base, maps, pages):
+        # the full baseline memory snapshot, type: envi.MemorySnapshot
+        self.base = base
+        # the bounds of the memory maps, sorted, type: List[Tuple[int, int]]
+        self.maps = maps
+        # the contents of the written pages, clipped to the memory maps, type: Dict[int, bytes]
+        self.pages = pages
+
+    def get_regions(self):
+        '''
+        Get the contiguous runs of written memory, along with their
+         contents in the baseline snapshot.
+        Runs that are not part of the baseline, like new heap memory,
+         have no previous contents.
+
+        :rtype: List[Tuple[int, Union[bytes, None], bytes]]
+        :return: tuples of (va, bytes before or None, bytes after).
+        '''
+        map_starts = set(start for start, _ in self.maps)
+        # list of [start, end, page contents]
+        runs = []
+        for va in sorted(self.pages.keys()):
+            buf = self.pages[va]
+            if runs and runs[-1][1] == va and va not in map_starts:
+                runs[-1][1] += len(buf)
+                runs[-1][2].append(buf)
+            else:
+                runs.append([va, va + len(buf), [buf]])
+
+        regions = []
+        for va, _, bufs in runs:
+            bytes_after = b"".join(bufs)
+            bytes_before = None
+            for section_start, section_end, _, section_bytes in self.base:
+                if section_start <= va and va + len(bytes_after) <= section_end:
+                    offset = va - section_start
+                    bytes_before = section_bytes[offset:offset + len(bytes_after)]
+                    break
+            regions.append((va, bytes_before, bytes_after))
+        return regions
+
+
+class DirtyPageTracker(object):
+    '''
+    Track the pages of emulator memory that are written or newly mapped,
+     so that snapshots only need to copy these pages.
+    This wraps `writeMemory` and `addMemoryMap` of the given emulator instance
+     until `close` is called.
+    '''
+    def __init__(self, emu, base):
+        '''
+        :type emu: envi.Emulator
+        :type base: envi.MemorySnapshot
+        :param base: The full memory snapshot to which changes are relative.
+        '''
+        self._emu = emu
+        self._base = base
+        # pages written since the most recent snapshot
+        self._pages = set([])
+        # the contents of the pages captured by earlier snapshots,
+        #  clipped to the memory maps, type: Dict[int, bytes]
+        self._contents = {}
+        # the sorted bounds of the memory maps, or None when a map has been added
+        self._maps = None
+
+        self._write_memory = emu.writeMemory
+        self._add_memory_map = emu.addMemoryMap
+        emu.writeMemory = self._on_write_memory
+        emu.addMemoryMap = self._on_add_memory_map
+
+    def close(self):
+        '''
+        Restore the original methods of the emulator.
+        '''
+        self._emu.writeMemory = self._write_memory
+        self._emu.addMemoryMap = self._add_memory_map
+
+    def _mark_dirty(self, va, size):
+        page = va - (va % PAGE_SIZE)
+        while page < va + size:
+            self._pages.add(page)
+            page += PAGE_SIZE
+
+    def _on_write_memory(self, va, bytez, *args, **kwargs):
+        self._mark_dirty(va, len(bytez))
+        return self._write_memory(va, bytez, *args, **kwargs)
+
+    def _on_add_memory_map(self, va, perms, fname, bytez, *args, **kwargs):
+        ret = self._add_memory_map(va, perms, fname, bytez, *args, **kwargs)
+        self._maps = None
+        self._mark_dirty(va, len(bytez))
+        return ret
+
+    def snapshot(self):
+        '''
+        Copy the pages written since the baseline snapshot.
+        Only the pages written since the previous call are read from the emulator,
+         the contents of the other pages are reused from earlier calls.
 
+        :rtype: DirtySnapshot
+        '''
+        if self._maps is None:
+            self._maps = sorted((va, va + size) for va, size, _, _ in self._emu.getMemoryMaps())
+        maps = self._maps
+        map_starts = [start for start, _ in maps]
+        # maps are only ever added, so recapturing a page overwrites or extends its earlier entries
+        pages = self._contents
+        for page in self._pages:
+            page_end = page + PAGE_SIZE
+            # a page may overlap more than one memory map, or none at all
+            i = max(bisect.bisect_right(map_starts, page) - 1, 0)
+            while i < len(maps) and maps[i][0] < page_end:
+                start = max(page, maps[i][0])
+                end = min(page_end, maps[i][1])
+                if start < end:
+                    pages[start] = self._emu.readMemory(start, end - start)
+                i += 1
+        self._pages = set([])
+        # each snapshot gets its own copy, since later snapshots update the captured pages
+        return DirtySnapshot(self._base, maps, dict(pages))
+
+
+def get_memory_bounds(memory):
+    '''
+    Get the bounds of the memory maps in a memory snapshot.
 
-def make_snapshot(emu):
+    :type memory: Union[envi.MemorySnapshot, DirtySnapshot]
+    :rtype: List[Tuple[int, int]]
+    '''
+    if isinstance(memory, DirtySnapshot):
+        return memory.maps
+    return [(m[0], m[1]) for m in memory]
+
+
+def get_modified_regions(memory_before, memory_after, heap=None):
+    '''
+    Get the regions of memory that may differ between two memory snapshots.
+    Regions that don't exist in the earlier snapshot have no previous contents.
+    A DirtySnapshot must be compared against its own baseline snapshot.
+
+    :type memory_before: envi.MemorySnapshot
+    :type memory_after: Union[envi.MemorySnapshot, DirtySnapshot]
+    :type heap: List[Tuple[int, int, Tuple[Tuple[int, int], ...]]]
+    :param heap: The memory allocated from the emulated heap, see `HeapArena.get_allocated`.
+     New regions within the heap are split into one region per allocation.
+    :rtype: List[Tuple[int, Union[bytes, None], bytes]]
+    :return: tuples of (va, bytes before or None, bytes after).
+    '''
+    if isinstance(memory_after, DirtySnapshot):
+        regions = memory_after.get_regions()
+    else:
+        # maps from region start to section tuple
+        mem_before = {m[0]: m for m in memory_before}
+        regions = []
+        for (section_start, _, _, bytes_after) in memory_after:
+            if section_start not in mem_before:
+                regions.append((section_start, None, bytes_after))
+            else:
+                (_, _, _, bytes_before) = mem_before[section_start]
+                regions.append((section_start, bytes_before, bytes_after))
+
+    if not heap:
+        return regions
+
+    split = []
+    for va, bytes_before, bytes_after in regions:
+        allocations = None
+        if bytes_before is None:
+            for heap_start, heap_end, map_allocations in heap:
+                if heap_start <= va < heap_end:
+                    allocations = map_allocations
+                    break
+        if allocations is None:
+            split.append((va, bytes_before, bytes_after))
+            continue
+
+        # report each allocation on its own, so that strings in
+        #  neighbouring allocations are not joined.
+        end = va + len(bytes_after)
+        for allocation_start, allocation_end in allocations:
+            start = max(allocation_start, va)
+            stop = min(allocation_end, end)
+            if start < stop:
+                split.append((start, None, bytes_after[start - va:stop - va]))
+    return split
+
+
+class Snapshot(object):
+    '''
+    A snapshot represents the current state of the CPU and memory.
+    '''
+    __slots__ = ("memory", "sp", "pc", "heap")
+
+    def __init__(self, memory, sp, pc, heap=None):
+        # The memory snapshot, type: Union[envi.MemorySnapshot, DirtySnapshot]
+        self.memory = memory
+        # The current stack counter, type: int
+        self.sp = sp
+        # The current instruction pointer, type: int
+        self.pc = pc
+        # The memory allocated from the emulated heap, if any, see `HeapArena.get_allocated`
+        self.heap = heap
+
+    def __repr__(self):
+        return "Snapshot(sp=0x%x, pc=0x%x)" % (self.sp, self.pc)
+
+
+def make_snapshot(emu, dirty_pages=None, heap=None):
     '''
     Create a snapshot of the current CPU and memory.
+    Given a DirtyPageTracker, only copy the memory written since
+     its baseline snapshot.
+    Given a HeapArena, record the memory allocated from it so far.
 
+    :type dirty_pages: DirtyPageTracker
+    :type heap: HeapArena
     :rtype: Snapshot
     '''
-    return Snapshot(emu.getMemorySnap(), emu.getStackCounter(), emu.getProgramCounter())
+    if dirty_pages is None:
+        memory = emu.getMemorySnap()
+    else:
+        memory = dirty_pages.snapshot()
+    allocated = None
+    if heap is not None:
+        allocated = heap.get_allocated()
+    return Snapshot(memory, emu.getStackCounter(), emu.getProgramCounter(), allocated)
 
 
-# A Delta represents the pair of snapshots from before and
-#  after an operation. It facilitates diffing the state of
-#  an emalutor.
-Delta = namedtuple("Delta",
-        [   "pre_snap",  # type: Snapshot
-            "post_snap",  # type: Snapshot
-            ])
+class Delta(object):
+    '''
+    A Delta represents the pair of snapshots from before and
+     after an operation. It facilitates diffing the state of
+     an emulator.
+    '''
+    __slots__ = ("pre_snap", "post_snap")
+
+    def __init__(self, pre_snap, post_snap):
+        # type: Snapshot
+        self.pre_snap = pre_snap
+        # type: Snapshot
+        self.post_snap = post_snap
+
+    def __repr__(self):
+        return "Delta(pre_snap=%r, post_snap=%r)" % (self.pre_snap, self.post_snap)
 
 
 class DeltaCollectorHook(viv_utils.emulator_drivers.Hook):
     """
     hook that collects Deltas at each imported API call.
     """
-    def __init__(self, pre_snap):
+    def __init__(self, pre_snap, dirty_pages=None, heap=None):
         super(DeltaCollectorHook, self).__init__()
+        self.reset(pre_snap, dirty_pages, heap)
 
+    def reset(self, pre_snap, dirty_pages=None, heap=None):
+        '''
+        Start collecting a new sequence of Deltas relative to the given snapshot.
+        '''
         self._pre_snap = pre_snap
+        self._dirty_pages = dirty_pages
+        self._heap = heap
         # this is a public field
         self.deltas = []
 
     def hook(self, callname, driver, callconv, api, argv):
         if is_import(driver._emu, driver._emu.getProgramCounter()):
-            self.deltas.append(Delta(self._pre_snap, make_snapshot(driver._emu)))
+            post_snap = make_snapshot(driver._emu, self._dirty_pages, self._heap)
+            self.deltas.append(Delta(self._pre_snap, post_snap))
+
 
+class _PooledDriver(object):
+    '''
+    The emulator driver, monitor, and hooks used to emulate functions with
+     one emulator, so that they are only set up once per emulator.
+    '''
+    # name of the emulator attribute that holds its _PooledDriver.
+    # storing it on the emulator ties its lifetime to the emulator.
+    ATTRIBUTE_NAME = "_floss_pooled_driver"
+
+    def __init__(self, emu, function_index):
+        self.emu = emu
+        # the taints of the emulator before it first emulates, and the sequence of its later taints
+        self._taints = dict(emu.taints)
+        taint_va = next(emu.taintva)
+        self._taint_va_step = next(emu.taintva) - taint_va
+        self._taint_va = taint_va
+        self.stack_ops = STACK_OPS[emu.imem_psize]
+        self.driver = viv_utils.emulator_drivers.DebuggerEmulatorDriver(emu)
+        self.monitor = ApiMonitor(emu.vw, function_index, self.stack_ops)
+        self.heap = HeapArena()
+        self.delta_collector = DeltaCollectorHook(None)
+        self.dispatch_hook = DispatchHook(self.heap, self.stack_ops)
+        self.driver.add_monitor(self.monitor)
+        self.driver.add_hook(self.delta_collector)
+        self.driver.add_hook(self.dispatch_hook)
+
+    @classmethod
+    def get(cls, emu, function_index):
+        '''
+        Get the pooled driver of the given emulator, creating it on first use.
 
-def emulate_function(emu, function_index, fva, return_address, max_instruction_count):
+        :type emu: envi.Emulator
+        :type function_index: viv_utils.FunctionIndex
+        :rtype: _PooledDriver
+        '''
+        pooled = getattr(emu, cls.ATTRIBUTE_NAME, None)
+        if pooled is None:
+            pooled = cls(emu, function_index)
+            setattr(emu, cls.ATTRIBUTE_NAME, pooled)
+        elif pooled.monitor.function_index is not function_index:
+            # the monitor caches lookups into the function index
+            pooled.driver.remove_monitor(pooled.monitor)
+            pooled.monitor = ApiMonitor(emu.vw, function_index, pooled.stack_ops)
+            pooled.driver.add_monitor(pooled.monitor)
+        return pooled
+
+    def reset(self, pre_snap, dirty_pages=None):
+        '''
+        Prepare the emulator and hooks for emulating another function.
+        '''
+        # restoring a snapshot doesn't touch the emulator's code path, which logs every write,
+        #  nor its taints. reset them as a new emulator would have them, so they don't accumulate.
+        self.emu.path = self.emu.newCodePathNode()
+        self.emu.curpath = self.emu.path
+        self.emu.taints.clear()
+        self.emu.taints.update(self._taints)
+        self.emu.taintva = itertools.count(self._taint_va, self._taint_va_step)
+        self.emu.uninit_use.clear()
+
+        self.heap = HeapArena()
+        self.delta_collector.reset(pre_snap, dirty_pages, self.heap)
+        self.dispatch_hook.reset(self.heap)
+
+
+def emulate_function(emu, function_index, fva, return_address, max_instruction_count,
+                     full_snapshots=False):
     '''
     Emulate a function and collect snapshots at each interesting place.
     These interesting places include calls to imported API functions
@@ -328,41 +781,50 @@ def emulate_function(emu, function_index, fva, return_address, max_instruction_c
     :type max_instruction_count: int
     :param max_instruction_count: The max number of instructions to emulate.
      This helps avoid unexpected infinite loops.
+    :type full_snapshots: bool
+    :param full_snapshots: Copy all emulator memory at each snapshot,
+     rather than just the pages written during emulation.
     :rtype: Sequence[Delta]
     '''
     pre_snap = make_snapshot(emu)
-    delta_collector = DeltaCollectorHook(pre_snap)
+    dirty_pages = None
+    if not full_snapshots:
+        dirty_pages = DirtyPageTracker(emu, pre_snap.memory)
+    pooled = None
 
     try:
-        floss_logger.debug("Emulating function at 0x%08X", fva)
-        driver = viv_utils.emulator_drivers.DebuggerEmulatorDriver(emu)
-        monitor = ApiMonitor(emu.vw, function_index)
-        driver.add_monitor(monitor)
-        driver.add_hook(delta_collector)
-        driver.add_hook(GetProcessHeapHook())
-        driver.add_hook(RtlAllocateHeapHook())
-        driver.add_hook(AllocateHeap())
-        driver.add_hook(MallocHeap())
-        driver.add_hook(ExitProcessHook())
-        driver.runToVa(return_address, max_instruction_count)
-    except viv_utils.emulator_drivers.InstructionRangeExceededError:
-        floss_logger.debug("Halting as emulation has escaped!")
-    except envi.InvalidInstruction:
-        floss_logger.debug("vivisect encountered an invalid instruction. will continue processing.",
-                exc_info=True)
-    except envi.UnsupportedInstruction:
-        floss_logger.debug("vivisect encountered an unsupported instruction. will continue processing.",
-                exc_info=True)
-    except envi.BreakpointHit:
-        floss_logger.debug("vivisect encountered an unexpected emulation breakpoint. will continue processing.",
-                exc_info=True)
-    except viv_utils.emulator_drivers.StopEmulation as e:
-        pass
-    except Exception:
-        floss_logger.debug("vivisect encountered an unexpected exception. will continue processing.",
-                exc_info=True)
-    floss_logger.debug("Ended emulation at 0x%08X", emu.getProgramCounter())
-
-    deltas = delta_collector.deltas
-    deltas.append(Delta(pre_snap, make_snapshot(emu)))
+        try:
+            floss_logger.debug("Emulating function at 0x%08X", fva)
+            pooled = _PooledDriver.get(emu, function_index)
+            pooled.reset(pre_snap, dirty_pages)
+            pooled.driver.runToVa(return_address, max_instruction_count)
+        except viv_utils.emulator_drivers.InstructionRangeExceededError:
+            floss_logger.debug("Halting as emulation has escaped!")
+        except envi.InvalidInstruction:
+            floss_logger.debug("vivisect encountered an invalid instruction. will continue processing.",
+                    exc_info=True)
+        except envi.UnsupportedInstruction:
+            floss_logger.debug("vivisect encountered an unsupported instruction. will continue processing.",
+                    exc_info=True)
+        except envi.BreakpointHit:
+            floss_logger.debug("vivisect encountered an unexpected emulation breakpoint. will continue processing.",
+                    exc_info=True)
+        except viv_utils.emulator_drivers.StopEmulation as e:
+            pass
+        except Exception:
+            floss_logger.debug("vivisect encountered an unexpected exception. will continue processing.",
+                    exc_info=True)
+        floss_logger.debug("Ended emulation at 0x%08X", emu.getProgramCounter())
+
+        if pooled is not None:
+            deltas = pooled.delta_collector.deltas
+            heap = pooled.heap
+        else:
+            deltas = []
+            heap = None
+        deltas.append(Delta(pre_snap, make_snapshot(emu, dirty_pages, heap)))
+    finally:
+        # the emulator may be reused, so never leave its methods wrapped
+        if dirty_pages is not None:
+            dirty_pages.close()
     return deltas
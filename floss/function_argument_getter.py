@@ -3,7 +3,7 @@ from collections import namedtuple
 import viv_utils
 import viv_utils.emulator_drivers
 
-from utils import makeEmulator
+from floss.utils import makeEmulator
 
 # TODO get return address from emu_snap
 FunctionContext = namedtuple("FunctionContext", ["emu_snap", "return_address", "decoded_at_va"])
@@ -1,27 +1,21 @@
 #!/usr/bin/env python
 # encoding: utf-8
-from __future__ import print_function
 import os
 import sys
 import string
 import logging
-import pkg_resources
 from time import time
 from optparse import OptionParser
 
 import tabulate
 import plugnplay
-import viv_utils
 
-import strings
-import stackstrings
-import string_decoder
-import plugins.arithmetic_plugin
-import identification_manager as im
-import plugins.library_function_plugin
-import plugins.function_meta_data_plugin
-from interfaces import DecodingRoutineIdentifier
-from decoding_manager import LocationType
+import floss.strings as strings
+from floss.utils import makeEmulator
+from floss.interfaces import DecodingRoutineIdentifier
+
+# optimization: the modules that depend on vivisect are imported by the functions that use them,
+#  so that `--help`, `--version`, and static string extraction don't pay for loading vivisect.
 
 
 floss_version = "1.1.0\n" \
@@ -45,11 +39,15 @@ def decode_strings(vw, function_index, decoding_functions_candidates):
     :param decoding_functions_candidates: identification manager
     :return: list of decoded strings ([DecodedString])
     """
+    import floss.string_decoder as string_decoder
+
     decoded_strings = []
+    # optimization: each emulation restores its context, so share one emulator
+    emu = makeEmulator(vw)
     # TODO pass function list instead of identification manager
     for fva, _ in decoding_functions_candidates.get_top_candidate_functions(10):
         for ctx in string_decoder.extract_decoding_contexts(vw, fva):
-            for delta in string_decoder.emulate_decoding_routine(vw, function_index, fva, ctx):
+            for delta in string_decoder.emulate_decoding_routine(vw, function_index, fva, ctx, emu):
                 for delta_bytes in string_decoder.extract_delta_bytes(delta, ctx.decoded_at_va, fva):
                     for decoded_string in string_decoder.extract_strings(delta_bytes):
                         decoded_strings.append(decoded_string)
@@ -91,18 +89,22 @@ def get_all_plugins():
     """
     Return all plugins to be run.
     """
+    import floss.plugins.arithmetic_plugin as arithmetic_plugin
+    import floss.plugins.library_function_plugin as library_function_plugin
+    import floss.plugins.function_meta_data_plugin as function_meta_data_plugin
+
     ps = DecodingRoutineIdentifier.implementors()
     if len(ps) == 0:
-        ps.append(plugins.function_meta_data_plugin.FunctionCrossReferencesToPlugin())
-        ps.append(plugins.function_meta_data_plugin.FunctionArgumentCountPlugin())
-        ps.append(plugins.function_meta_data_plugin.FunctionIsThunkPlugin())
-        ps.append(plugins.function_meta_data_plugin.FunctionBlockCountPlugin())
-        ps.append(plugins.function_meta_data_plugin.FunctionInstructionCountPlugin())
-        ps.append(plugins.function_meta_data_plugin.FunctionSizePlugin())
-        ps.append(plugins.function_meta_data_plugin.FunctionRecursivePlugin())
-        ps.append(plugins.library_function_plugin.FunctionIsLibraryPlugin())
-        ps.append(plugins.arithmetic_plugin.XORPlugin())
-        ps.append(plugins.arithmetic_plugin.ShiftPlugin())
+        ps.append(function_meta_data_plugin.FunctionCrossReferencesToPlugin())
+        ps.append(function_meta_data_plugin.FunctionArgumentCountPlugin())
+        ps.append(function_meta_data_plugin.FunctionIsThunkPlugin())
+        ps.append(function_meta_data_plugin.FunctionBlockCountPlugin())
+        ps.append(function_meta_data_plugin.FunctionInstructionCountPlugin())
+        ps.append(function_meta_data_plugin.FunctionSizePlugin())
+        ps.append(function_meta_data_plugin.FunctionRecursivePlugin())
+        ps.append(library_function_plugin.FunctionIsLibraryPlugin())
+        ps.append(arithmetic_plugin.XORPlugin())
+        ps.append(arithmetic_plugin.ShiftPlugin())
     return ps
 
 
@@ -283,7 +285,7 @@ def print_decoding_results(decoded_strings, min_length, group_functions, quiet=F
     :param group_functions: group output by VA of decoding routines
     :param quiet: print strings only, suppresses headers
     """
-    long_strings = filter(lambda ds: len(ds.s) >= min_length, decoded_strings)
+    long_strings = list(filter(lambda ds: len(ds.s) >= min_length, decoded_strings))
 
     if not quiet:
         print("FLOSS decoded %d strings" % len(long_strings))
@@ -291,7 +293,7 @@ def print_decoding_results(decoded_strings, min_length, group_functions, quiet=F
     if group_functions:
         fvas = set(map(lambda i: i.fva, long_strings))
         for fva in fvas:
-            grouped_strings = filter(lambda ds: ds.fva == fva, long_strings)
+            grouped_strings = list(filter(lambda ds: ds.fva == fva, long_strings))
             len_ds = len(grouped_strings)
             if len_ds > 0:
                 if not quiet:
@@ -307,6 +309,8 @@ def print_decoded_strings(decoded_strings, quiet=False):
     :param decoded_strings: list of decoded strings ([DecodedString])
     :param quiet: print strings only, suppresses headers
     """
+    from floss.decoding_manager import LocationType
+
     if quiet:
         for ds in decoded_strings:
             print(sanitize_string_for_printing(ds.s))
@@ -334,6 +338,8 @@ def create_script_content(sample_file_path, decoded_strings):
     :param decoded_strings: list of decoded strings ([DecodedString])
     :return: content of the IDAPython script
     """
+    from floss.decoding_manager import LocationType
+
     main_commands = []
     for ds in decoded_strings:
         if ds.s != "":
@@ -383,7 +389,7 @@ def create_script(sample_file_path, ida_python_file, decoded_strings):
     """
     script_content = create_script_content(sample_file_path, decoded_strings)
     ida_python_file = os.path.abspath(ida_python_file)
-    with open(ida_python_file, 'wb') as f:
+    with open(ida_python_file, 'w') as f:
         try:
             f.write(script_content)
             print("Wrote IDAPython script file to %s\n" % ida_python_file)
@@ -474,10 +480,14 @@ def main():
 
     with open(sample_file_path, "rb") as f:
         magic = f.read(2)
-    if magic != "MZ":
+    if magic != b"MZ":
         floss_logger.error("FLOSS currently supports the following formats: PE")
         return
 
+    import viv_utils
+    import floss.stackstrings as stackstrings
+    import floss.identification_manager as im
+
     floss_logger.info("Generating vivisect workspace")
     vw = viv_utils.getWorkspace(sample_file_path)
 
@@ -486,7 +496,7 @@ def main():
 
     selected_plugin_names = select_plugins(options.plugins)
     floss_logger.debug("Selected the following plugins: %s", ", ".join(map(str, selected_plugin_names)))
-    selected_plugins = filter(lambda p: str(p) in selected_plugin_names, get_all_plugins())
+    selected_plugins = list(filter(lambda p: str(p) in selected_plugin_names, get_all_plugins()))
 
     time0 = time()
 
@@ -1,4 +1,4 @@
-import plugin_object
+import floss.plugins.plugin_object as plugin_object
 import floss.interfaces as interfaces
 
 
@@ -5,8 +5,8 @@ import envi.archs.i386
 import envi.archs.amd64
 import viv_utils.emulator_drivers
 
-import strings
-from utils import makeEmulator
+import floss.strings as strings
+from floss.utils import makeEmulator
 
 
 CallContext = namedtuple("CallContext",
@@ -14,7 +14,7 @@ CallContext = namedtuple("CallContext",
             "pc",  # the current program counter, type: int
             "sp",  # the current stack counter, type: int
             "init_sp",   # the initial stack counter at start of function, type: int
-            "stack_memory",  # the active stack frame contents, type: str
+            "stack_memory",  # the active stack frame contents, type: bytes
         ])
 
 
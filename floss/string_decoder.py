@@ -2,11 +2,11 @@ import logging
 
 import envi.memory
 
-import strings
-import decoding_manager
-from utils import makeEmulator
-from function_argument_getter import get_function_contexts
-from decoding_manager import DecodedString, LocationType
+import floss.strings as strings
+import floss.decoding_manager as decoding_manager
+from floss.utils import makeEmulator
+from floss.function_argument_getter import get_function_contexts
+from floss.decoding_manager import DecodedString, LocationType
 
 
 floss_logger = logging.getLogger("floss")
@@ -27,7 +27,7 @@ def extract_decoding_contexts(vw, function):
     return get_function_contexts(vw, function)
 
 
-def emulate_decoding_routine(vw, function_index, function, context):
+def emulate_decoding_routine(vw, function_index, function, context, emu=None):
     '''
     Emulate a function with a given context and extract the CPU and
      memory contexts at interesting points during emulation.
@@ -47,9 +47,13 @@ def emulate_decoding_routine(vw, function_index, function, context):
     :type context: funtion_argument_getter.FunctionContext
     :param context: The initial state of the CPU and memory
       prior to the function being called.
+    :type emu: envi.Emulator
+    :param emu: The emulator to reuse, if any. Its state is replaced by the
+      given context, so a single emulator can be shared across calls.
     :rtype: Sequence[decoding_manager.Delta]
     '''
-    emu = makeEmulator(vw)
+    if emu is None:
+        emu = makeEmulator(vw)
     emu.setEmuSnap(context.emu_snap)
     floss_logger.debug("Emulating function at 0x%08X called at 0x%08X, return address: 0x%08X",
                        function, context.decoded_at_va, context.return_address)
@@ -82,32 +86,26 @@ def extract_delta_bytes(delta, decoded_at_va, source_fva=0x0):
     memory_snap_after = delta.post_snap.memory
     sp = delta.post_snap.sp
 
-    # maps from region start to section tuple
-    mem_before = {m[0]: m for m in memory_snap_before}
-    mem_after = {m[0]: m for m in memory_snap_after}
-
     stack_start = 0x0
     stack_end = 0x0
-    for m in memory_snap_after:
-        if m[0] <= sp < m[1]:
-            stack_start, stack_end = m[0], m[1]
+    for section_start, section_end in decoding_manager.get_memory_bounds(memory_snap_after):
+        if section_start <= sp < section_end:
+            stack_start, stack_end = section_start, section_end
 
     # iterate memory from after the decoding, since if somethings been allocated,
     # we want to know. don't care if things have been deallocated.
-    for section_after_start, section_after in mem_after.items():
-        (_, _, _, bytes_after) = section_after
-        if section_after_start not in mem_before:
+    for region_start, bytes_before, bytes_after in decoding_manager.get_modified_regions(memory_snap_before,
+                                                                                          memory_snap_after,
+                                                                                          delta.post_snap.heap):
+        if bytes_before is None:
             characteristics = {"location_type": LocationType.HEAP}
-            delta_bytes.append(DecodedString(section_after_start, bytes_after,
+            delta_bytes.append(DecodedString(region_start, bytes_after,
                                              decoded_at_va, source_fva, characteristics))
             continue
 
-        section_before = mem_before[section_after_start]
-        (_, _, _, bytes_before) = section_before
-
         memory_diff = envi.memory.memdiff(bytes_before, bytes_after)
         for offset, length in memory_diff:
-            address = section_after_start + offset
+            address = region_start + offset
 
             if stack_start <= address <= sp:
                 # every stack address that exceeds the stack pointer can be
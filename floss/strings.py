@@ -2,8 +2,8 @@ import re
 from collections import namedtuple
 
 
-ASCII_BYTE = " !\"#\$%&\'\(\)\*\+,-\./0123456789:;<=>\?@ABCDEFGHIJKLMNOPQRSTUVWXYZ\[\]\^_`abcdefghijklmnopqrstuvwxyz\{\|\}\\\~\t"
-ASCII_RE_4 = re.compile("([%s]{%d,})" % (ASCII_BYTE, 4))
+ASCII_BYTE = rb" !\"#\$%&\'\(\)\*\+,-\./0123456789:;<=>\?@ABCDEFGHIJKLMNOPQRSTUVWXYZ\[\]\^_`abcdefghijklmnopqrstuvwxyz\{\|\}\\\~\t"
+ASCII_RE_4 = re.compile(b"([%s]{%d,})" % (ASCII_BYTE, 4))
 UNICODE_RE_4 = re.compile(b"((?:[%s]\x00){%d,})" % (ASCII_BYTE, 4))
 
 
@@ -15,7 +15,7 @@ def extract_ascii_strings(buf, n=4):
     Extract ASCII strings from the given binary data.
 
     :param buf: A bytestring.
-    :type buf: str
+    :type buf: bytes
     :param n: The minimum length of strings to extract.
     :type n: int
     :rtype: Sequence[String]
@@ -24,7 +24,7 @@ def extract_ascii_strings(buf, n=4):
     if n == 4:
         r = ASCII_RE_4
     else:
-        reg = "([%s]{%d,})" % (ASCII_BYTE, n)
+        reg = b"([%s]{%d,})" % (ASCII_BYTE, n)
         r = re.compile(reg)
     for match in r.finditer(buf):
         yield String(match.group().decode("ascii"), match.start())
@@ -35,7 +35,7 @@ def extract_unicode_strings(buf, n=4):
     Extract naive UTF-16 strings from the given binary data.
 
     :param buf: A bytestring.
-    :type buf: str
+    :type buf: bytes
     :param n: The minimum length of strings to extract.
     :type n: int
     :rtype: Sequence[String]
@@ -12,10 +12,10 @@ requirements = [
     "q",
     "pyyaml",
     "tabulate",
-    "vivisect",
+    # viv-utils 0.6.x is the last release series with the LoggingObject and emulator driver APIs used here
+    "vivisect==1.0.6",
     "plugnplay",
-    "viv-utils",
-    "enum34"
+    "viv-utils==0.6.10",
 ]
 
 setup(
@@ -38,12 +38,13 @@ setup(
     },
     include_package_data=True,
     install_requires=requirements,
+    python_requires=">=3.7",
     zip_safe=False,
     keywords='floss',
     classifiers=[
         'Development Status :: 4 - Beta',
         'Intended Audience :: Developers',
         'Natural Language :: English',
-        "Programming Language :: Python :: 2",
+        "Programming Language :: Python :: 3",
     ],
 )
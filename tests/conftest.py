@@ -27,7 +27,7 @@ def extract_strings(sample_path):
 def identify_decoding_functions(vw):
     selected_functions = floss_main.select_functions(vw, None)
     selected_plugin_names = floss_main.select_plugins(None)
-    selected_plugins = filter(lambda p: str(p) in selected_plugin_names, floss_main.get_all_plugins())
+    selected_plugins = list(filter(lambda p: str(p) in selected_plugin_names, floss_main.get_all_plugins()))
     decoding_functions_candidates = im.identify_decoding_functions(vw, selected_plugins, selected_functions)
     return decoding_functions_candidates
 
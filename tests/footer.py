@@ -7,7 +7,7 @@ import logging
 FILE_START = 0
 FILE_END = 2
 
-MAGIC = "FLSS"
+MAGIC = b"FLSS"
 SIZE_OFFSET = 4
 SIZE_LEN = 4
 SIZE_MAGIC = len(MAGIC)
@@ -59,6 +59,6 @@ def write_footer(sample_path, test_dict):
     file_size = os.path.getsize(sample_path)
     test_data = struct.pack("<II", file_size, data_len)
     with open(sample_path, "ab") as f:
-        f.write(json_data + test_data + MAGIC)
+        f.write(json_data.encode("utf-8") + test_data + MAGIC)
 
 
@@ -0,0 +1,185 @@
+import random
+
+import envi.memory
+import envi.archs.i386
+
+import floss.decoding_manager as decoding_manager
+from floss.decoding_manager import PAGE_SIZE, HeapArena, DirtyPageTracker
+
+
+def make_memory(rng):
+    '''
+    Create a memory object with some adjacent and some sparse maps,
+     whose sizes are not all page-aligned.
+    '''
+    mem = envi.memory.MemoryObject()
+    va = 0x10000
+    for _ in range(rng.randint(1, 4)):
+        size = rng.choice([PAGE_SIZE, 3 * PAGE_SIZE, rng.randint(1, 3 * PAGE_SIZE)])
+        mem.addMemoryMap(va, envi.memory.MM_RWX, "map", bytes(rng.getrandbits(8) for _ in range(size)))
+        va += size
+        if rng.random() < 0.5:
+            va = decoding_manager.round_up(va + rng.randint(1, 2 * PAGE_SIZE), 0x10)
+    return mem
+
+
+def random_write(rng, mem):
+    maps = mem.getMemoryMaps()
+    va, size, _, _ = rng.choice(maps)
+    offset = rng.randrange(size)
+    length = rng.randint(1, min(size - offset, 2 * PAGE_SIZE))
+    mem.writeMemory(va + offset, bytes(rng.getrandbits(8) for _ in range(length)))
+
+
+def random_map(rng, mem):
+    end = max(va + size for va, size, _, _ in mem.getMemoryMaps())
+    size = rng.randint(1, 2 * PAGE_SIZE)
+    mem.addMemoryMap(end, envi.memory.MM_RWX, "new", bytes(rng.getrandbits(8) for _ in range(size)))
+
+
+def get_changes(memory_before, memory_after):
+    '''
+    Get the contents of the bytes that changed or were mapped,
+     according to the modified regions.
+
+    :rtype: Dict[int, int]
+    '''
+    changes = {}
+    for va, bytes_before, bytes_after in decoding_manager.get_modified_regions(memory_before, memory_after):
+        if bytes_before is None:
+            for i, b in enumerate(bytes_after):
+                changes[va + i] = b
+            continue
+        for offset, length in envi.memory.memdiff(bytes_before, bytes_after):
+            for i in range(offset, offset + length):
+                changes[va + i] = bytes_after[i]
+    return changes
+
+
+def test_dirty_snapshots_match_full_snapshots():
+    rng = random.Random(0x464c5353)
+    for _ in range(150):
+        mem = make_memory(rng)
+        base = mem.getMemorySnap()
+        tracker = DirtyPageTracker(mem, base)
+        try:
+            snaps = []
+            for _ in range(rng.randint(1, 4)):
+                for _ in range(rng.randint(0, 6)):
+                    if rng.random() < 0.2:
+                        random_map(rng, mem)
+                    else:
+                        random_write(rng, mem)
+                snaps.append((tracker.snapshot(), mem.getMemorySnap()))
+        finally:
+            tracker.close()
+
+        # earlier snapshots must not change as later ones are taken
+        for dirty_snap, full_snap in snaps:
+            assert get_changes(base, dirty_snap) == get_changes(base, full_snap)
+
+
+def test_get_stack_values():
+    emu = envi.archs.i386.IntelEmulator()
+    emu.addMemoryMap(0x1000, envi.memory.MM_RWX, "[stack]", bytes(range(0x10)) * 0x100)
+    stack = decoding_manager.STACK_OPS[4]
+
+    emu.setStackCounter(0x1000)
+    assert stack.get_stack_values(emu, 0, 4) == (0x03020100, 0x07060504, 0x0b0a0908, 0x0f0e0d0c)
+
+    # a window that runs past the end of the stack map yields the values that can be read
+    emu.setStackCounter(0x2000 - 8)
+    assert stack.get_stack_values(emu, 0, 4) == (0x0b0a0908, 0x0f0e0d0c)
+
+
+def test_dirty_page_tracker_close():
+    mem = envi.memory.MemoryObject()
+    mem.addMemoryMap(0x1000, envi.memory.MM_RWX, "map", bytes(PAGE_SIZE))
+    write_memory = mem.writeMemory
+    add_memory_map = mem.addMemoryMap
+    tracker = DirtyPageTracker(mem, mem.getMemorySnap())
+    assert mem.writeMemory != write_memory
+    tracker.close()
+    assert mem.writeMemory == write_memory
+    assert mem.addMemoryMap == add_memory_map
+
+
+def test_round_up():
+    assert decoding_manager.round_up(0, 0x10) == 0
+    assert decoding_manager.round_up(1, 0x10) == 0x10
+    assert decoding_manager.round_up(0x10, 0x10) == 0x10
+    assert decoding_manager.round_up(0x11, 0x10) == 0x20
+    assert decoding_manager.round_up(0x1001, PAGE_SIZE) == 0x2000
+
+
+def test_heap_arena():
+    mem = envi.memory.MemoryObject()
+    heap = HeapArena()
+
+    a = heap.allocate(mem, 3)
+    b = heap.allocate(mem, 0x20)
+    assert a == HeapArena.BASE_ADDRESS
+    assert b == a + HeapArena.ALIGNMENT
+    # small allocations share one page
+    assert mem.getMemoryMaps() == [(a, PAGE_SIZE, envi.memory.MM_RWX, "[heap]")]
+
+    # an allocation that doesn't fit is mapped on its own, rounded up to a page
+    c = heap.allocate(mem, PAGE_SIZE + 1)
+    assert c == a + PAGE_SIZE
+    assert mem.getMemoryMap(c)[1] == 2 * PAGE_SIZE
+
+    assert mem.readMemory(c, PAGE_SIZE + 1) == bytes(PAGE_SIZE + 1)
+    assert heap.get_allocated() == [
+        (a, a + PAGE_SIZE, ((a, a + 0x10), (b, b + 0x20))),
+        (c, c + 2 * PAGE_SIZE, ((c, c + PAGE_SIZE + 0x10),)),
+    ]
+
+
+def test_heap_regions_are_clipped_to_allocations():
+    mem = envi.memory.MemoryObject()
+    mem.addMemoryMap(0x1000, envi.memory.MM_RWX, "map", bytes(PAGE_SIZE))
+    base = mem.getMemorySnap()
+    tracker = DirtyPageTracker(mem, base)
+    try:
+        heap = HeapArena()
+        va = heap.allocate(mem, 0x20)
+        mem.writeMemory(va, b"hello world")
+        snap = tracker.snapshot()
+    finally:
+        tracker.close()
+
+    regions = decoding_manager.get_modified_regions(base, snap, heap.get_allocated())
+    assert regions == [(va, None, b"hello world" + bytes(0x20 - len(b"hello world")))]
+    full_regions = decoding_manager.get_modified_regions(base, mem.getMemorySnap(), heap.get_allocated())
+    assert [r for r in full_regions if r[1] is None] == regions
+
+
+def test_adjacent_heap_allocations_are_separate_regions():
+    mem = envi.memory.MemoryObject()
+    base = mem.getMemorySnap()
+    tracker = DirtyPageTracker(mem, base)
+    try:
+        heap = HeapArena()
+        a = heap.allocate(mem, 0x10)
+        b = heap.allocate(mem, 0x10)
+        assert b == a + 0x10
+        mem.writeMemory(a, b"0123456789abcdef")
+        mem.writeMemory(b, b"ghijklmn\x00")
+        snap = tracker.snapshot()
+    finally:
+        tracker.close()
+
+    regions = decoding_manager.get_modified_regions(base, snap, heap.get_allocated())
+    assert regions == [
+        (a, None, b"0123456789abcdef"),
+        (b, None, b"ghijklmn" + bytes(0x10 - len(b"ghijklmn"))),
+    ]
+    assert decoding_manager.get_modified_regions(base, mem.getMemorySnap(), heap.get_allocated()) == regions
+
+
+def test_decoded_string():
+    ds = decoding_manager.DecodedString(0x1000, "hello", 0x401000, 0x402000, {})
+    assert ds == decoding_manager.DecodedString(0x1000, "hello", 0x401000, 0x402000, {})
+    va, s, decoded_at_va, fva, characteristics = ds
+    assert (va, s) == (0x1000, "hello")
+    assert ds._asdict()["fva"] == 0x402000